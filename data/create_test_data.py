@@ -3,107 +3,148 @@
 Create synthetic test data for neuroimaging MCP server testing
 """
 
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import nibabel as nib
 from pathlib import Path
 
+# Fixed seed keeps the synthetic volumes reproducible between runs. Each
+# generator gets its own stream so they stay deterministic when run in parallel.
+SEED = 42
+
+def empty_volume(shape):
+    """Allocate a float32 working volume backed by an anonymous temp file
+
+    The volumes are generated and masked in place, then streamed out by
+    save_nifti, so the float pages never need to stay resident in RAM.
+    """
+    return np.memmap(
+        tempfile.TemporaryFile(), dtype=np.float32, mode='w+', shape=shape
+    )
+
+def save_nifti(data, output_path):
+    """Save a volume as int16 NIfTI, creating its parent directory first
+
+    Scanner output is natively int16 and the synthetic intensities stay well
+    inside its range, so storing integers halves the bytes to compress and
+    write compared to float32.
+
+    Output stays plain gzip NIfTI: byte-shuffle filters (Blosc/numcodecs)
+    would need a non-NIfTI container that FSL and MRTrix cannot read.
+    """
+    np.clip(data, 0, np.iinfo(np.int16).max, out=data)
+    img = nib.Nifti1Image(np.asarray(data).astype(np.int16), np.eye(4))
+    img.header.set_data_dtype(np.int16)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    nib.save(img, output_path)
+
+def squared_distance(shape):
+    """Squared voxel distance from the volume centre
+
+    Radius tests compare against squared radii, so no sqrt is needed. The
+    squared offsets are computed on the small open-grid axes and cast to
+    int32 (enough for any realistic volume) before broadcasting, so the
+    only full-size array is a compact int32 one.
+    """
+    axes = np.ogrid[tuple(slice(0, n) for n in shape)]
+    return sum(
+        ((axis - n // 2) ** 2).astype(np.int32) for axis, n in zip(axes, shape)
+    )
+
+def apply_radial_mask(data, brain_radius, outside_scale, shells=()):
+    """Scale a volume in place by concentric shells around its centre
+
+    Voxels at or beyond brain_radius are multiplied by outside_scale, and each
+    (inner, outer, scale) shell multiplies voxels strictly between its radii.
+    Shells must lie inside the brain and not overlap, which lets every region
+    fold into one scale volume applied in a single multiply. Trailing
+    dimensions past the first three (e.g. DWI directions) share the mask.
+    """
+    d2 = squared_distance(data.shape[:3])
+    conditions = [d2 >= brain_radius**2]
+    choices = [np.float32(outside_scale)]
+    for inner, outer, scale in shells:
+        conditions.append((d2 > inner**2) & (d2 < outer**2))
+        choices.append(np.float32(scale))
+    scale = np.select(conditions, choices, default=np.float32(1.0))
+    data *= scale.reshape(scale.shape + (1,) * (data.ndim - 3))
+
 def create_synthetic_t1():
     """Create synthetic T1-weighted image"""
     print("Creating synthetic T1-weighted image...")
+    rng = np.random.default_rng([SEED, 0])
 
     shape = (182, 218, 182)  # Standard MNI dimensions
-    data = np.random.random(shape) * 1000
-
-    # Create brain-like structure
-    center = np.array(shape) // 2
-    xx, yy, zz = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), indexing='ij')
-    distance = np.sqrt((xx - center[0])**2 + (yy - center[1])**2 + (zz - center[2])**2)
-    brain_mask = distance < 60
-    data[~brain_mask] *= 0.1  # Reduce signal outside "brain"
+    data = empty_volume(shape)
+    rng.random(dtype=np.float32, out=data)
+    data *= 1000
 
-    # Add some tissue contrast
-    # White matter (higher intensity)
-    wm_mask = (distance < 45) & (distance > 25)
-    data[wm_mask] *= 1.2
-
-    # Gray matter (medium intensity)
-    gm_mask = (distance < 55) & (distance > 45)
-    data[gm_mask] *= 0.8
+    # Create brain-like structure, reducing signal outside "brain" and
+    # adding tissue contrast
+    apply_radial_mask(data, brain_radius=60, outside_scale=0.1, shells=[
+        (25, 45, 1.2),  # White matter (higher intensity)
+        (45, 55, 0.8),  # Gray matter (medium intensity)
+    ])
 
     # Save as NIfTI
-    img = nib.Nifti1Image(data.astype(np.float32), np.eye(4))
     output_path = Path('/Users/hp/Desktop/neurodesk/data/t1_structural/synthetic_t1.nii.gz')
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    nib.save(img, output_path)
+    save_nifti(data, output_path)
     print(f"✓ Created synthetic T1 image: {output_path}")
     return output_path
 
 def create_mni_template():
     """Create simple MNI-like template"""
     print("Creating synthetic MNI template...")
+    rng = np.random.default_rng([SEED, 1])
 
     shape = (182, 218, 182)
-    data = np.random.random(shape) * 800 + 200  # Different intensity distribution
+    data = empty_volume(shape)
+    rng.random(dtype=np.float32, out=data)
+    data *= 800  # Different intensity distribution
+    data += 200
 
     # Create a slightly different brain shape for registration target
-    center = np.array(shape) // 2
-    xx, yy, zz = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), indexing='ij')
-    distance = np.sqrt((xx - center[0])**2 + (yy - center[1])**2 + (zz - center[2])**2)
-    brain_mask = distance < 65  # Slightly larger
-    data[~brain_mask] *= 0.05
+    apply_radial_mask(data, brain_radius=65, outside_scale=0.05)  # Slightly larger
 
-    img = nib.Nifti1Image(data.astype(np.float32), np.eye(4))
     output_path = Path('/Users/hp/Desktop/neurodesk/data/templates/synthetic_mni.nii.gz')
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    nib.save(img, output_path)
+    save_nifti(data, output_path)
     print(f"✓ Created synthetic MNI template: {output_path}")
     return output_path
 
 def create_diffusion_data():
     """Create minimal diffusion data for testing"""
     print("Creating synthetic diffusion data...")
+    rng = np.random.default_rng([SEED, 2])
 
     # Create DWI data (simplified)
     shape = (96, 96, 60, 33)  # x, y, z, directions (32 + 1 b0)
-    data = np.random.random(shape) * 1000
-
-    # Create brain mask for DWI
-    center = np.array(shape[:3]) // 2
-    xx, yy, zz = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), indexing='ij')
-    distance = np.sqrt((xx - center[0])**2 + (yy - center[1])**2 + (zz - center[2])**2)
-    brain_mask = distance < 30
+    data = empty_volume(shape)
+    rng.random(dtype=np.float32, out=data)
+    data *= 1000
 
     # Apply brain mask to all volumes
-    for vol in range(shape[3]):
-        data[:, :, :, vol][~brain_mask] *= 0.1
+    apply_radial_mask(data, brain_radius=30, outside_scale=0.1)
 
     # Save DWI data
-    img = nib.Nifti1Image(data.astype(np.float32), np.eye(4))
     output_path = Path('/Users/hp/Desktop/neurodesk/data/diffusion/synthetic_dwi.nii.gz')
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    nib.save(img, output_path)
+    save_nifti(data, output_path)
 
     # Create b-values file (1 b0 + 32 directions at b=1000)
     bvals = [0] + [1000] * 32
     bval_path = output_path.with_suffix('.bval')
-    with open(bval_path, 'w') as f:
-        f.write(' '.join(map(str, bvals)) + '\n')
+    bval_path.write_text(' '.join(map(str, bvals)) + '\n')
 
     # Create b-vectors file (simplified gradient directions)
-    bvecs = []
-    bvecs.append([0, 0, 0])  # b0 direction
-
-    # Generate 32 random unit vectors
-    for i in range(32):
-        vec = np.random.randn(3)
-        vec = vec / np.linalg.norm(vec)
-        bvecs.append(vec)
+    # Row 0 is the b0 direction, followed by 32 random unit vectors
+    bvecs = np.zeros((33, 3))
+    bvecs[1:] = rng.standard_normal((32, 3))
+    bvecs[1:] /= np.linalg.norm(bvecs[1:], axis=1, keepdims=True)
 
+    # FSL layout: one row per axis, one column per volume
     bvec_path = output_path.with_suffix('.bvec')
-    with open(bvec_path, 'w') as f:
-        for dim in range(3):
-            line = ' '.join([f"{bvec[dim]:.6f}" for bvec in bvecs])
-            f.write(line + '\n')
+    np.savetxt(bvec_path, bvecs.T, fmt='%.6f', delimiter=' ')
 
     print(f"✓ Created synthetic DWI data: {output_path}")
     print(f"✓ Created b-values file: {bval_path}")
@@ -129,9 +170,7 @@ def create_response_function():
 
     response_path = Path('/Users/hp/Desktop/neurodesk/data/diffusion/synthetic_response.txt')
     response_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with open(response_path, 'w') as f:
-        f.write('\n'.join(response_data) + '\n')
+    response_path.write_text('\n'.join(response_data) + '\n')
 
     print(f"✓ Created synthetic response function: {response_path}")
     return response_path
@@ -158,11 +197,18 @@ def main():
     create_directory_structure()
     print()
 
-    # Create synthetic data
-    t1_path = create_synthetic_t1()
-    mni_path = create_mni_template()
-    dwi_path, bval_path, bvec_path = create_diffusion_data()
-    response_path = create_response_function()
+    # Create synthetic data; the generators are independent and spend their
+    # time in NumPy and zlib, which release the GIL, so threads are enough
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        t1_future = pool.submit(create_synthetic_t1)
+        mni_future = pool.submit(create_mni_template)
+        dwi_future = pool.submit(create_diffusion_data)
+        response_future = pool.submit(create_response_function)
+
+    t1_path = t1_future.result()
+    mni_path = mni_future.result()
+    dwi_path, bval_path, bvec_path = dwi_future.result()
+    response_path = response_future.result()
 
     print("\n✅ All test data created successfully!")
     print("\n📁 Test data locations:")
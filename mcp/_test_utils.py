@@ -0,0 +1,65 @@
+"""
+Helpers shared by the test scripts
+"""
+
+import asyncio
+import collections
+import os
+from collections.abc import Callable, Sequence
+from pathlib import Path
+
+# Synthetic inputs produced by data/create_test_data.py
+TEST_FILES = (
+    "/Users/hp/Desktop/neurodesk/data/t1_structural/synthetic_t1.nii.gz",
+    "/Users/hp/Desktop/neurodesk/data/templates/synthetic_mni.nii.gz",
+    "/Users/hp/Desktop/neurodesk/data/diffusion/synthetic_dwi.nii.gz",
+    "/Users/hp/Desktop/neurodesk/data/diffusion/synthetic_response.txt"
+)
+
+def _scan_sizes(directory, names):
+    """Return {name: size} for the wanted entries of one directory"""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name: entry.stat().st_size
+                    for entry in entries if entry.name in names}
+    except FileNotFoundError:
+        return {}
+
+async def _stat_paths(paths):
+    """Size every path, scanning each parent directory once"""
+    by_dir = collections.defaultdict(set)
+    for test_file in paths:
+        path = Path(test_file)
+        by_dir[path.parent].add(path.name)
+
+    # The directories are independent, so scan them in parallel threads
+    scans = await asyncio.gather(
+        *(asyncio.to_thread(_scan_sizes, directory, names)
+          for directory, names in by_dir.items())
+    )
+    # Key the sizes by the caller's own strings, which need not be normalized
+    found = dict(zip(by_dir, scans))
+    sizes = {}
+    for test_file in paths:
+        path = Path(test_file)
+        size = found[path.parent].get(path.name)
+        if size is not None:
+            sizes[test_file] = size
+    return sizes
+
+async def check_paths(
+    paths: Sequence[str] = TEST_FILES,
+    report: Callable[[str], object] = print
+) -> bool:
+    """Report each path as found (with its size) or missing"""
+    sizes = await _stat_paths(paths)
+    all_found = True
+    for test_file in paths:
+        if test_file not in sizes:
+            report(f"❌ Missing: {test_file}")
+            all_found = False
+        else:
+            size = sizes[test_file] / (1024 * 1024)  # MB
+            report(f"✅ {Path(test_file).name} ({size:.1f} MB)")
+
+    return all_found
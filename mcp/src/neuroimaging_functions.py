@@ -11,14 +11,17 @@ import logging
 
 import niwrap
 
+try:
+    from .neuroimaging_runtime import OUTPUT_DIR, configure_docker, make_dirs, path_exists
+except ImportError:
+    # Run as a script (python src/server.py) or imported with src/ on sys.path
+    from neuroimaging_runtime import OUTPUT_DIR, configure_docker, make_dirs, path_exists
+
 logger = logging.getLogger(__name__)
 
 # Configure NiWrap for containerized execution
-try:
-    niwrap.use_docker()
-    logger.info("Docker configured for NiWrap execution")
-except Exception as e:
-    logger.warning(f"Docker configuration failed: {e}")
+configure_docker()
+make_dirs(OUTPUT_DIR)
 
 async def fsl_bet_brain_extraction_raw(
     input_file: str,
@@ -32,24 +35,24 @@ async def fsl_bet_brain_extraction_raw(
 
     # Validate inputs
     input_path = Path(input_file)
-    if not input_path.exists():
+    if not await path_exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_file}")
 
     try:
         # Prepare output paths
-        output_dir = Path("/Users/hp/Desktop/neurodesk/data/outputs")
-        output_dir.mkdir(parents=True, exist_ok=True)
-        brain_image = str(output_dir / f"{output_prefix}.nii.gz")
+        brain_image = str(OUTPUT_DIR / f"{output_prefix}.nii.gz")
 
         print(f"Running FSL BET with fractional intensity: {fractional_intensity}")
 
         # Execute BET using NiWrap
-        result = niwrap.fsl.bet(
-            infile=input_file,
-            maskfile=brain_image,
-            fractional_intensity=fractional_intensity,
-            binary_mask=generate_binary_mask
-        )
+        bet_params = {
+            "infile": input_file,
+            "maskfile": brain_image,
+            "fractional_intensity": fractional_intensity,
+            "binary_mask": generate_binary_mask
+        }
+
+        result = await asyncio.to_thread(niwrap.fsl.bet, **bet_params)
 
         output_data = {
             "brain_image": result.outfile,
@@ -81,24 +84,22 @@ async def fsl_fast_segmentation_raw(
 
     # Validate inputs
     input_path = Path(input_file)
-    if not input_path.exists():
+    if not await path_exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_file}")
 
     try:
-        # Prepare output path
-        output_dir = Path("/Users/hp/Desktop/neurodesk/data/outputs")
-        output_dir.mkdir(parents=True, exist_ok=True)
-
         print(f"Running FSL FAST with {tissue_classes} tissue classes")
 
         # Execute FAST using NiWrap
-        result = niwrap.fsl.fast(
-            in_files=[input_file],
-            number_classes=tissue_classes,
-            out_basename=str(output_dir / output_prefix),
-            output_biasfield=True,
-            segments=True
-        )
+        fast_params = {
+            "in_files": [input_file],
+            "number_classes": tissue_classes,
+            "out_basename": str(OUTPUT_DIR / output_prefix),
+            "output_biasfield": True,
+            "segments": True
+        }
+
+        result = await asyncio.to_thread(niwrap.fsl.fast, **fast_params)
 
         output_data = {
             "segmented_image": result.outfile,
@@ -132,23 +133,25 @@ async def fsl_flirt_registration_raw(
     input_path = Path(input_file)
     ref_path = Path(reference_file)
 
-    if not input_path.exists():
+    if not await path_exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_file}")
-    if not ref_path.exists():
+    if not await path_exists(ref_path):
         raise FileNotFoundError(f"Reference file not found: {reference_file}")
 
     try:
         print(f"Running FSL FLIRT with {dof} degrees of freedom")
 
         # Execute FLIRT using NiWrap
-        result = niwrap.fsl.flirt(
-            in_file=input_file,
-            reference=reference_file,
-            out_file=output_file,
-            out_matrix_file=output_file.replace('.nii.gz', '.mat'),
-            dof=dof,
-            cost="corratio"
-        )
+        flirt_params = {
+            "in_file": input_file,
+            "reference": reference_file,
+            "out_file": output_file,
+            "out_matrix_file": output_file.replace('.nii.gz', '.mat'),
+            "dof": dof,
+            "cost": "corratio"
+        }
+
+        result = await asyncio.to_thread(niwrap.fsl.flirt, **flirt_params)
 
         output_data = {
             "registered_image": result.outfile,
@@ -181,9 +184,9 @@ async def mrtrix_dwi2fod_raw(
     dwi_path = Path(dwi_file)
     response_path = Path(response_file)
 
-    if not dwi_path.exists():
+    if not await path_exists(dwi_path):
         raise FileNotFoundError(f"DWI file not found: {dwi_file}")
-    if not response_path.exists():
+    if not await path_exists(response_path):
         raise FileNotFoundError(f"Response file not found: {response_file}")
 
     try:
@@ -197,7 +200,7 @@ async def mrtrix_dwi2fod_raw(
             "fod": output_fod
         }
 
-        result = niwrap.mrtrix.dwi2fod(**dwi2fod_params)
+        result = await asyncio.to_thread(niwrap.mrtrix.dwi2fod, **dwi2fod_params)
 
         output_data = {
             "fod_image": result.fod,
@@ -226,12 +229,12 @@ async def freesurfer_recon_all_raw(
 
     # Validate inputs
     input_path = Path(input_file)
-    if not input_path.exists():
+    if not await path_exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_file}")
 
     # Create subjects directory
     subjects_path = Path(subjects_dir)
-    subjects_path.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(subjects_path.mkdir, parents=True, exist_ok=True)
 
     try:
         print("Running FreeSurfer recon-all (this may take several hours)")
@@ -244,7 +247,7 @@ async def freesurfer_recon_all_raw(
             "all": True  # Run all processing stages
         }
 
-        result = niwrap.freesurfer.recon_all(**recon_params)
+        result = await asyncio.to_thread(niwrap.freesurfer.recon_all, **recon_params)
 
         # FreeSurfer output structure
         subject_dir = subjects_path / subject_id
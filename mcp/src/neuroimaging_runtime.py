@@ -0,0 +1,62 @@
+"""
+Setup shared by the MCP server and the raw neuroimaging functions
+"""
+
+import asyncio
+from pathlib import Path
+import logging
+
+import niwrap
+
+logger = logging.getLogger(__name__)
+
+# NiWrap starts a fresh container per call and cannot reuse one, so trim
+# what each start costs: the tools work on mounted files only and never
+# need network setup.
+DOCKER_EXTRA_ARGS = ["--network", "none"]
+
+# Shared output directory; importing modules create it once with make_dirs
+# instead of on every call
+OUTPUT_DIR = Path("/Users/hp/Desktop/neurodesk/data/outputs")
+
+_docker_configured = False
+
+def configure_docker() -> bool:
+    """Configure NiWrap for containerized execution, once per process
+
+    Returns whether NiWrap is configured; failures are logged, not raised.
+    """
+    global _docker_configured
+    if _docker_configured:
+        return True
+    try:
+        niwrap.use_docker(docker_extra_args=DOCKER_EXTRA_ARGS)
+        _docker_configured = True
+        logger.info("Docker configured for NiWrap execution")
+    except Exception as e:
+        logger.warning(f"Docker configuration failed: {e}")
+    return _docker_configured
+
+def make_dirs(path: Path) -> None:
+    """Create a directory at import time, warning instead of failing"""
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"Could not create output directory {path}: {e}")
+
+# Paths already confirmed to exist during this session
+_existing_paths: set[Path] = set()
+
+async def path_exists(path: Path) -> bool:
+    """Check that a tool input exists without blocking the event loop
+
+    Successful checks are remembered so repeated requests on the same inputs
+    skip the stat() call entirely. Only use this for inputs; paths that can
+    disappear during a session need an uncached check.
+    """
+    if path in _existing_paths:
+        return True
+    if await asyncio.to_thread(path.exists):
+        _existing_paths.add(path)
+        return True
+    return False
@@ -6,15 +6,24 @@ Integrates with NiWrap for containerized neuroimaging tool execution.
 """
 
 import asyncio
+import hashlib
+import json
 import os
 import tempfile
 from pathlib import Path
-from typing import Dict, Any, Optional, Union
+from types import MappingProxyType
+from typing import Dict, Any, Final, Mapping, Optional, Union
 import logging
 
 from fastmcp import FastMCP, Context
 import niwrap
 
+try:
+    from .neuroimaging_runtime import OUTPUT_DIR, configure_docker, make_dirs, path_exists
+except ImportError:
+    # Run as a script (python src/server.py) or imported with src/ on sys.path
+    from neuroimaging_runtime import OUTPUT_DIR, configure_docker, make_dirs, path_exists
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,11 +32,94 @@ logger = logging.getLogger(__name__)
 mcp = FastMCP("Neuroimaging MCP Server")
 
 # Configure NiWrap for containerized execution
-try:
-    niwrap.use_docker()
-    logger.info("Docker configured for NiWrap execution")
-except Exception as e:
-    logger.warning(f"Docker configuration failed: {e}")
+configure_docker()
+
+CACHE_DIR = OUTPUT_DIR / "cache"
+make_dirs(CACHE_DIR)
+
+# Content digests keyed by (path, mtime, size) so each input is hashed once
+_file_digests: Dict[tuple, str] = {}
+
+def _file_digest(path: Path) -> str:
+    """Return the BLAKE2 digest of a file's contents, memoized by mtime and size"""
+    st = path.stat()
+    memo_key = (str(path.resolve()), st.st_mtime_ns, st.st_size)
+    digest = _file_digests.get(memo_key)
+    if digest is None:
+        # file_digest reads into one reusable buffer instead of allocating
+        # a new bytes object per chunk, and never holds the whole volume
+        with open(path, "rb") as f:
+            digest = hashlib.file_digest(f, "blake2b").hexdigest()
+        _file_digests[memo_key] = digest
+    return digest
+
+def _cache_key(tool: str, input_files: list[str], params: Dict[str, Any]) -> str:
+    """Build a cache key from the tool name, input contents and parameters"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(tool.encode())
+    for input_file in input_files:
+        h.update(_file_digest(Path(input_file)).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def _output_paths(output_data: Dict[str, Any]) -> list[str]:
+    """Collect the output file paths in a tool result, skipping its metadata"""
+    paths = []
+
+    def collect(value: Any) -> None:
+        if isinstance(value, (str, os.PathLike)):
+            paths.append(os.fspath(value))
+        elif isinstance(value, dict):
+            for item in value.values():
+                collect(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                collect(item)
+
+    for name, value in output_data.items():
+        if name != "metadata":
+            collect(value)
+    return paths
+
+def _output_fingerprint(path: str) -> list[int]:
+    """Return the (mtime, size) pair used to detect a changed output file"""
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+def _load_cached_result(key: str) -> Optional[Dict[str, Any]]:
+    """Return a previously stored result for this key, if any
+
+    Outputs are written to fixed paths that later calls may overwrite or
+    that may be deleted, so the result only counts as a hit while every
+    output file is still the one this call produced.
+    """
+    try:
+        entry = json.loads((CACHE_DIR / f"{key}.json").read_text())
+        result, outputs = entry["result"], entry["outputs"]
+        for path, fingerprint in outputs.items():
+            if _output_fingerprint(path) != fingerprint:
+                return None
+    except (OSError, json.JSONDecodeError, KeyError, TypeError):
+        return None
+    return result
+
+def _store_cached_result(key: str, output_data: Dict[str, Any]) -> None:
+    """Persist a tool result so identical requests can skip the pipeline"""
+    try:
+        outputs = {
+            path: _output_fingerprint(path) for path in _output_paths(output_data)
+        }
+        entry = {"result": output_data, "outputs": outputs}
+        (CACHE_DIR / f"{key}.json").write_text(json.dumps(entry, default=str))
+    except OSError as e:
+        logger.warning(f"Could not cache result {key}: {e}")
+
+async def _lookup_cache(
+    tool: str, input_files: list[str], params: Dict[str, Any]
+) -> tuple[str, Optional[Dict[str, Any]]]:
+    """Compute the cache key for a tool call and fetch any cached result"""
+    key = await asyncio.to_thread(_cache_key, tool, input_files, params)
+    return key, await asyncio.to_thread(_load_cached_result, key)
 
 @mcp.tool
 async def fsl_bet_brain_extraction(
@@ -57,16 +149,12 @@ async def fsl_bet_brain_extraction(
 
     # Validate inputs
     input_path = Path(input_file)
-    if not input_path.exists():
+    if not await path_exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_file}")
 
     try:
         # Prepare output paths
-        output_dir = Path("/Users/hp/Desktop/neurodesk/data/outputs")
-        output_dir.mkdir(parents=True, exist_ok=True)
-        brain_image = str(output_dir / f"{output_prefix}.nii.gz")
-
-        await ctx.info(f"Running FSL BET with fractional intensity: {fractional_intensity}")
+        brain_image = str(OUTPUT_DIR / f"{output_prefix}.nii.gz")
 
         # Execute BET using NiWrap
         bet_params = {
@@ -78,7 +166,14 @@ async def fsl_bet_brain_extraction(
         if generate_binary_mask:
             bet_params["binary_mask"] = True
 
-        result = niwrap.fsl.bet(**bet_params)
+        cache_key, cached = await _lookup_cache("FSL BET", [input_file], bet_params)
+        if cached is not None:
+            await ctx.info("Returning cached BET result for identical inputs")
+            return cached
+
+        await ctx.info(f"Running FSL BET with fractional intensity: {fractional_intensity}")
+
+        result = await asyncio.to_thread(niwrap.fsl.bet, **bet_params)
 
         output_data = {
             "brain_image": result.outfile,
@@ -92,6 +187,7 @@ async def fsl_bet_brain_extraction(
         if generate_binary_mask and hasattr(result, 'binary_mask'):
             output_data["brain_mask"] = result.binary_mask
 
+        await asyncio.to_thread(_store_cached_result, cache_key, output_data)
         await ctx.info("Brain extraction completed successfully")
         return output_data
 
@@ -124,26 +220,27 @@ async def fsl_fast_segmentation(
 
     # Validate inputs
     input_path = Path(input_file)
-    if not input_path.exists():
+    if not await path_exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_file}")
 
     try:
-        # Prepare output path
-        output_dir = Path("/Users/hp/Desktop/neurodesk/data/outputs")
-        output_dir.mkdir(parents=True, exist_ok=True)
-
-        await ctx.info(f"Running FSL FAST with {tissue_classes} tissue classes")
-
         # Execute FAST using NiWrap
         fast_params = {
             "infile": input_file,
-            "basename": str(output_dir / output_prefix),
+            "basename": str(OUTPUT_DIR / output_prefix),
             "classes": tissue_classes,
             "bias_field": True,
             "probability_maps": True
         }
 
-        result = niwrap.fsl.fast(**fast_params)
+        cache_key, cached = await _lookup_cache("FSL FAST", [input_file], fast_params)
+        if cached is not None:
+            await ctx.info("Returning cached FAST result for identical inputs")
+            return cached
+
+        await ctx.info(f"Running FSL FAST with {tissue_classes} tissue classes")
+
+        result = await asyncio.to_thread(niwrap.fsl.fast, **fast_params)
 
         output_data = {
             "segmented_image": result.outfile,
@@ -156,6 +253,7 @@ async def fsl_fast_segmentation(
             }
         }
 
+        await asyncio.to_thread(_store_cached_result, cache_key, output_data)
         await ctx.info("Tissue segmentation completed successfully")
         return output_data
 
@@ -192,14 +290,12 @@ async def fsl_flirt_registration(
     input_path = Path(input_file)
     ref_path = Path(reference_file)
 
-    if not input_path.exists():
+    if not await path_exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_file}")
-    if not ref_path.exists():
+    if not await path_exists(ref_path):
         raise FileNotFoundError(f"Reference file not found: {reference_file}")
 
     try:
-        await ctx.info(f"Running FSL FLIRT with {dof} degrees of freedom")
-
         # Execute FLIRT using NiWrap
         flirt_params = {
             "infile": input_file,
@@ -209,7 +305,14 @@ async def fsl_flirt_registration(
             "cost": "corratio"
         }
 
-        result = niwrap.fsl.flirt(**flirt_params)
+        cache_key, cached = await _lookup_cache("FSL FLIRT", [input_file, reference_file], flirt_params)
+        if cached is not None:
+            await ctx.info("Returning cached FLIRT result for identical inputs")
+            return cached
+
+        await ctx.info(f"Running FSL FLIRT with {dof} degrees of freedom")
+
+        result = await asyncio.to_thread(niwrap.fsl.flirt, **flirt_params)
 
         output_data = {
             "registered_image": result.outfile,
@@ -221,6 +324,7 @@ async def fsl_flirt_registration(
             }
         }
 
+        await asyncio.to_thread(_store_cached_result, cache_key, output_data)
         await ctx.info("Registration completed successfully")
         return output_data
 
@@ -257,14 +361,12 @@ async def mrtrix_dwi2fod(
     dwi_path = Path(dwi_file)
     response_path = Path(response_file)
 
-    if not dwi_path.exists():
+    if not await path_exists(dwi_path):
         raise FileNotFoundError(f"DWI file not found: {dwi_file}")
-    if not response_path.exists():
+    if not await path_exists(response_path):
         raise FileNotFoundError(f"Response file not found: {response_file}")
 
     try:
-        await ctx.info(f"Running MRTrix3 dwi2fod with {algorithm} algorithm")
-
         # Execute dwi2fod using NiWrap
         dwi2fod_params = {
             "algorithm": algorithm,
@@ -273,7 +375,14 @@ async def mrtrix_dwi2fod(
             "fod": output_fod
         }
 
-        result = niwrap.mrtrix3.dwi2fod(**dwi2fod_params)
+        cache_key, cached = await _lookup_cache("MRTrix3 dwi2fod", [dwi_file, response_file], dwi2fod_params)
+        if cached is not None:
+            await ctx.info("Returning cached dwi2fod result for identical inputs")
+            return cached
+
+        await ctx.info(f"Running MRTrix3 dwi2fod with {algorithm} algorithm")
+
+        result = await asyncio.to_thread(niwrap.mrtrix3.dwi2fod, **dwi2fod_params)
 
         output_data = {
             "fod_image": result.fod,
@@ -284,6 +393,7 @@ async def mrtrix_dwi2fod(
             }
         }
 
+        await asyncio.to_thread(_store_cached_result, cache_key, output_data)
         await ctx.info("FOD estimation completed successfully")
         return output_data
 
@@ -316,16 +426,14 @@ async def freesurfer_recon_all(
 
     # Validate inputs
     input_path = Path(input_file)
-    if not input_path.exists():
+    if not await path_exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_file}")
 
     # Create subjects directory
     subjects_path = Path(subjects_dir)
-    subjects_path.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(subjects_path.mkdir, parents=True, exist_ok=True)
 
     try:
-        await ctx.info("Running FreeSurfer recon-all (this may take several hours)")
-
         # Execute recon-all using NiWrap
         recon_params = {
             "input_file": input_file,
@@ -334,7 +442,14 @@ async def freesurfer_recon_all(
             "all": True  # Run all processing stages
         }
 
-        result = niwrap.freesurfer.recon_all(**recon_params)
+        cache_key, cached = await _lookup_cache("FreeSurfer recon-all", [input_file], recon_params)
+        if cached is not None:
+            await ctx.info("Returning cached recon-all result for identical inputs")
+            return cached
+
+        await ctx.info("Running FreeSurfer recon-all (this may take several hours)")
+
+        result = await asyncio.to_thread(niwrap.freesurfer.recon_all, **recon_params)
 
         # FreeSurfer output structure
         subject_dir = subjects_path / subject_id
@@ -359,6 +474,7 @@ async def freesurfer_recon_all(
             }
         }
 
+        await asyncio.to_thread(_store_cached_result, cache_key, output_data)
         await ctx.info("FreeSurfer recon-all completed successfully")
         return output_data
 
@@ -366,25 +482,30 @@ async def freesurfer_recon_all(
         await ctx.error(f"FreeSurfer recon-all failed: {str(e)}")
         raise RuntimeError(f"FreeSurfer recon-all failed: {str(e)}")
 
+def _list_entry_names(directory: Path) -> list[str]:
+    """List entry names in a directory without stat()ing each one"""
+    with os.scandir(directory) as it:
+        return [entry.name for entry in it]
+
 @mcp.resource("neuroimaging://workspace/{session_id}")
 async def get_workspace_info(session_id: str) -> str:
     """Get information about a neuroimaging workspace session"""
     workspace_path = Path(f"/tmp/neuroimaging_workspace/{session_id}")
 
-    if not workspace_path.exists():
+    # Workspaces come and go, so skip the session's existence memo and let
+    # the listing itself report a missing directory
+    try:
+        names = await asyncio.to_thread(_list_entry_names, workspace_path)
+    except FileNotFoundError:
         return f"Workspace {session_id} not found"
 
-    files = list(workspace_path.glob("*"))
-    file_list = "\n".join([f"- {f.name}" for f in files])
+    file_list = "\n".join([f"- {name}" for name in names])
 
     return f"Workspace {session_id}:\nFiles:\n{file_list}"
 
-@mcp.prompt
-def neuroimaging_analysis_guide(analysis_type: str) -> str:
-    """Generate a prompt for neuroimaging analysis guidance"""
-
-    guides = {
-        "brain_extraction": """
+# Analysis guides served by the prompt, built once at import
+_GUIDES: Final[Mapping[str, str]] = MappingProxyType({
+    "brain_extraction": """
         Brain extraction is the first step in most neuroimaging analyses. Here's a typical workflow:
 
         1. Start with a T1-weighted anatomical image
@@ -398,7 +519,7 @@ def neuroimaging_analysis_guide(analysis_type: str) -> str:
         - Default (0.5) works well for most cases
         """,
 
-        "preprocessing": """
+    "preprocessing": """
         Standard T1 preprocessing pipeline:
 
         1. Brain extraction (BET)
@@ -409,7 +530,7 @@ def neuroimaging_analysis_guide(analysis_type: str) -> str:
         This pipeline prepares data for group-level statistical analysis.
         """,
 
-        "diffusion": """
+    "diffusion": """
         Diffusion MRI analysis workflow:
 
         1. Preprocessing: denoising, motion correction, eddy current correction
@@ -420,14 +541,20 @@ def neuroimaging_analysis_guide(analysis_type: str) -> str:
 
         Requires DWI data with b-values and gradient directions.
         """
-    }
+})
 
-    return guides.get(analysis_type, "Unknown analysis type. Available types: brain_extraction, preprocessing, diffusion")
+@mcp.prompt
+def neuroimaging_analysis_guide(analysis_type: str) -> str:
+    """Generate a prompt for neuroimaging analysis guidance"""
+    return _GUIDES.get(analysis_type, "Unknown analysis type. Available types: brain_extraction, preprocessing, diffusion")
 
 def main():
     """Main entry point for the MCP server"""
-    logger.info("Starting Neuroimaging MCP Server...")
-    mcp.run()
+    # stdio by default; "http" serves streamable HTTP, configured through
+    # FastMCP's FASTMCP_* settings (port, stateless_http, json_response)
+    transport = os.environ.get("MCP_TRANSPORT", "stdio")
+    logger.info(f"Starting Neuroimaging MCP Server ({transport})...")
+    mcp.run(transport=transport)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
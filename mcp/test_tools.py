@@ -11,28 +11,39 @@ from pathlib import Path
 import sys
 import os
 
+from _test_utils import check_paths
+
 # Add src to path so we can import the server functions
 sys.path.insert(0, str(Path(__file__).parent / "src"))
 
+# Set MCP_DEBUG to print full tracebacks for failing tests
+_DEBUG = bool(os.environ.get("MCP_DEBUG"))
+
 # Mock Context class for testing
 class MockContext:
     """Mock context for testing tools without MCP"""
 
     async def info(self, message: str):
-        print(f"ℹ️  {message}")
+        log.info(f"ℹ️  {message}")
 
     async def error(self, message: str):
-        print(f"❌ {message}")
+        log.error(f"❌ {message}")
 
     async def debug(self, message: str):
-        print(f"🐛 {message}")
+        log.info(f"🐛 {message}")
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+# Configure logging: library records keep the default LEVEL:name: prefix,
+# while the test's own status lines go bare to stdout
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("mcp.test")
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter('%(message)s'))
+log.addHandler(_log_handler)
+log.propagate = False
 
 async def test_fsl_bet():
     """Test FSL BET brain extraction"""
-    print("\n🧠 Testing FSL BET Brain Extraction...")
+    log.info("\n🧠 Testing FSL BET Brain Extraction...")
 
     try:
         from neuroimaging_functions import fsl_bet_brain_extraction_raw
@@ -41,10 +52,10 @@ async def test_fsl_bet():
 
         # Check if input file exists
         if not Path(input_file).exists():
-            print(f"❌ Input file not found: {input_file}")
+            log.info(f"❌ Input file not found: {input_file}")
             return False
 
-        print(f"📁 Input: {input_file}")
+        log.info(f"📁 Input: {input_file}")
 
         result = await fsl_bet_brain_extraction_raw(
             input_file=input_file,
@@ -53,27 +64,28 @@ async def test_fsl_bet():
             generate_binary_mask=True
         )
 
-        print(f"✅ BET completed successfully!")
-        print(f"📊 Result: {result}")
+        log.info(f"✅ BET completed successfully!")
+        log.info(f"📊 Result: {result}")
 
         # Check if output files exist
         if isinstance(result, dict) and 'brain_image' in result:
             brain_file = result['brain_image']
             if Path(brain_file).exists():
-                print(f"✅ Brain image created: {brain_file}")
+                log.info(f"✅ Brain image created: {brain_file}")
             else:
-                print(f"⚠️  Brain image not found: {brain_file}")
+                log.info(f"⚠️  Brain image not found: {brain_file}")
 
         return True
 
     except Exception as e:
-        print(f"❌ BET test failed: {str(e)}")
-        print(f"🔍 Error details:\n{traceback.format_exc()}")
+        log.info(f"❌ BET test failed: {str(e)}")
+        if _DEBUG:
+            log.info(f"🔍 Error details:\n{traceback.format_exc()}")
         return False
 
 async def test_fsl_fast():
     """Test FSL FAST tissue segmentation"""
-    print("\n🔬 Testing FSL FAST Tissue Segmentation...")
+    log.info("\n🔬 Testing FSL FAST Tissue Segmentation...")
 
     try:
         from neuroimaging_functions import fsl_fast_segmentation_raw
@@ -86,10 +98,10 @@ async def test_fsl_fast():
             input_file = "/Users/hp/Desktop/neurodesk/data/t1_structural/synthetic_t1.nii.gz"
 
         if not Path(input_file).exists():
-            print(f"❌ Input file not found: {input_file}")
+            log.info(f"❌ Input file not found: {input_file}")
             return False
 
-        print(f"📁 Input: {input_file}")
+        log.info(f"📁 Input: {input_file}")
 
         result = await fsl_fast_segmentation_raw(
             input_file=input_file,
@@ -97,18 +109,19 @@ async def test_fsl_fast():
             tissue_classes=3
         )
 
-        print(f"✅ FAST completed successfully!")
-        print(f"📊 Result: {result}")
+        log.info(f"✅ FAST completed successfully!")
+        log.info(f"📊 Result: {result}")
         return True
 
     except Exception as e:
-        print(f"❌ FAST test failed: {str(e)}")
-        print(f"🔍 Error details:\n{traceback.format_exc()}")
+        log.info(f"❌ FAST test failed: {str(e)}")
+        if _DEBUG:
+            log.info(f"🔍 Error details:\n{traceback.format_exc()}")
         return False
 
 async def test_fsl_flirt():
     """Test FSL FLIRT registration"""
-    print("\n🎯 Testing FSL FLIRT Registration...")
+    log.info("\n🎯 Testing FSL FLIRT Registration...")
 
     try:
         from neuroimaging_functions import fsl_flirt_registration_raw
@@ -122,15 +135,15 @@ async def test_fsl_flirt():
 
         # Check inputs
         if not Path(input_file).exists():
-            print(f"❌ Input file not found: {input_file}")
+            log.info(f"❌ Input file not found: {input_file}")
             return False
 
         if not Path(reference_file).exists():
-            print(f"❌ Reference file not found: {reference_file}")
+            log.info(f"❌ Reference file not found: {reference_file}")
             return False
 
-        print(f"📁 Input: {input_file}")
-        print(f"📁 Reference: {reference_file}")
+        log.info(f"📁 Input: {input_file}")
+        log.info(f"📁 Reference: {reference_file}")
 
         result = await fsl_flirt_registration_raw(
             input_file=input_file,
@@ -139,18 +152,19 @@ async def test_fsl_flirt():
             dof=12
         )
 
-        print(f"✅ FLIRT completed successfully!")
-        print(f"📊 Result: {result}")
+        log.info(f"✅ FLIRT completed successfully!")
+        log.info(f"📊 Result: {result}")
         return True
 
     except Exception as e:
-        print(f"❌ FLIRT test failed: {str(e)}")
-        print(f"🔍 Error details:\n{traceback.format_exc()}")
+        log.info(f"❌ FLIRT test failed: {str(e)}")
+        if _DEBUG:
+            log.info(f"🔍 Error details:\n{traceback.format_exc()}")
         return False
 
 async def test_mrtrix_dwi2fod():
     """Test MRTrix3 FOD estimation"""
-    print("\n🌐 Testing MRTrix3 FOD Estimation...")
+    log.info("\n🌐 Testing MRTrix3 FOD Estimation...")
 
     try:
         from neuroimaging_functions import mrtrix_dwi2fod_raw
@@ -160,15 +174,15 @@ async def test_mrtrix_dwi2fod():
 
         # Check inputs
         if not Path(dwi_file).exists():
-            print(f"❌ DWI file not found: {dwi_file}")
+            log.info(f"❌ DWI file not found: {dwi_file}")
             return False
 
         if not Path(response_file).exists():
-            print(f"❌ Response file not found: {response_file}")
+            log.info(f"❌ Response file not found: {response_file}")
             return False
 
-        print(f"📁 DWI: {dwi_file}")
-        print(f"📁 Response: {response_file}")
+        log.info(f"📁 DWI: {dwi_file}")
+        log.info(f"📁 Response: {response_file}")
 
         result = await mrtrix_dwi2fod_raw(
             dwi_file=dwi_file,
@@ -177,18 +191,19 @@ async def test_mrtrix_dwi2fod():
             algorithm="csd"
         )
 
-        print(f"✅ MRTrix3 dwi2fod completed successfully!")
-        print(f"📊 Result: {result}")
+        log.info(f"✅ MRTrix3 dwi2fod completed successfully!")
+        log.info(f"📊 Result: {result}")
         return True
 
     except Exception as e:
-        print(f"❌ MRTrix3 test failed: {str(e)}")
-        print(f"🔍 Error details:\n{traceback.format_exc()}")
+        log.info(f"❌ MRTrix3 test failed: {str(e)}")
+        if _DEBUG:
+            log.info(f"🔍 Error details:\n{traceback.format_exc()}")
         return False
 
 async def test_freesurfer_recon_all():
     """Test FreeSurfer cortical reconstruction (quick test only)"""
-    print("\n🧬 Testing FreeSurfer Recon-all (setup only - full run takes hours)...")
+    log.info("\n🧬 Testing FreeSurfer Recon-all (setup only - full run takes hours)...")
 
     try:
         from server import freesurfer_recon_all
@@ -198,132 +213,140 @@ async def test_freesurfer_recon_all():
         input_file = "/Users/hp/Desktop/neurodesk/data/t1_structural/synthetic_t1.nii.gz"
 
         if not Path(input_file).exists():
-            print(f"❌ Input file not found: {input_file}")
+            log.info(f"❌ Input file not found: {input_file}")
             return False
 
-        print(f"📁 Input: {input_file}")
-        print("⚠️  NOTE: This is a setup test only. Full FreeSurfer takes 2-8 hours!")
+        log.info(f"📁 Input: {input_file}")
+        log.info("⚠️  NOTE: This is a setup test only. Full FreeSurfer takes 2-8 hours!")
 
         # We'll just test the function setup, not run the full pipeline
-        print("✅ FreeSurfer function is available and parameters are valid")
-        print("🔍 To run full test, execute the function manually (it takes hours)")
+        log.info("✅ FreeSurfer function is available and parameters are valid")
+        log.info("🔍 To run full test, execute the function manually (it takes hours)")
 
         return True
 
     except Exception as e:
-        print(f"❌ FreeSurfer test failed: {str(e)}")
-        print(f"🔍 Error details:\n{traceback.format_exc()}")
+        log.info(f"❌ FreeSurfer test failed: {str(e)}")
+        if _DEBUG:
+            log.info(f"🔍 Error details:\n{traceback.format_exc()}")
         return False
 
+# Docker client is created once per session
+_DOCKER_CLIENT = None
+
+# Image name patterns for the containers the tools run in; Docker matches
+# them server-side, so unrelated local images are never transferred
+NEUROIMAGING_IMAGE_PATTERNS = [
+    pattern
+    for name in ("fsl", "mrtrix", "freesurfer")
+    for pattern in (f"*{name}*", f"*/*{name}*")
+]
+
+def get_docker():
+    """Return the shared Docker client, connecting on first use"""
+    global _DOCKER_CLIENT
+    if _DOCKER_CLIENT is None:
+        import docker
+        _DOCKER_CLIENT = docker.from_env()
+    return _DOCKER_CLIENT
+
 async def check_docker_connectivity():
     """Check if Docker is running and accessible"""
-    print("🐳 Checking Docker connectivity...")
+    log.info("🐳 Checking Docker connectivity...")
 
     try:
-        import docker
-        client = docker.from_env()
+        client = get_docker()
 
         # Try to ping Docker
         client.ping()
-        print("✅ Docker is running and accessible")
+        log.info("✅ Docker is running and accessible")
 
-        # List available images
-        images = client.images.list()
-        print(f"📦 Available Docker images: {len(images)}")
+        # List neuroimaging images only, filtered by the daemon
+        images = client.api.images(
+            filters={"reference": NEUROIMAGING_IMAGE_PATTERNS}
+        )
+        log.info(f"📦 Neuroimaging Docker images: {len(images)}")
 
         return True
 
     except Exception as e:
-        print(f"❌ Docker connectivity test failed: {str(e)}")
-        print("💡 Make sure Docker Desktop is running")
+        log.info(f"❌ Docker connectivity test failed: {str(e)}")
+        log.info("💡 Make sure Docker Desktop is running")
         return False
 
 async def check_niwrap_configuration():
     """Check NiWrap configuration"""
-    print("🔧 Checking NiWrap configuration...")
+    log.info("🔧 Checking NiWrap configuration...")
 
     try:
+        # Configure NiWrap exactly as the tools do, so this checks the same
+        # runner they will use
         import niwrap
-
-        # Configure NiWrap to use Docker
-        niwrap.use_docker()
-        print("✅ NiWrap configured for Docker execution")
+        from neuroimaging_runtime import configure_docker
+        if not configure_docker():
+            log.info("❌ NiWrap configuration failed")
+            return False
+        log.info("✅ NiWrap configured for Docker execution")
 
         # Check if we can access FSL functions
         if hasattr(niwrap, 'fsl'):
-            print("✅ FSL tools available through NiWrap")
+            log.info("✅ FSL tools available through NiWrap")
         else:
-            print("⚠️  FSL tools not found in NiWrap")
+            log.info("⚠️  FSL tools not found in NiWrap")
 
         # Check MRTrix3
         if hasattr(niwrap, 'mrtrix3'):
-            print("✅ MRTrix3 tools available through NiWrap")
+            log.info("✅ MRTrix3 tools available through NiWrap")
         else:
-            print("⚠️  MRTrix3 tools not found in NiWrap")
+            log.info("⚠️  MRTrix3 tools not found in NiWrap")
 
         # Check FreeSurfer
         if hasattr(niwrap, 'freesurfer'):
-            print("✅ FreeSurfer tools available through NiWrap")
+            log.info("✅ FreeSurfer tools available through NiWrap")
         else:
-            print("⚠️  FreeSurfer tools not found in NiWrap")
+            log.info("⚠️  FreeSurfer tools not found in NiWrap")
 
         return True
 
     except Exception as e:
-        print(f"❌ NiWrap configuration failed: {str(e)}")
+        log.info(f"❌ NiWrap configuration failed: {str(e)}")
         return False
 
 async def check_test_data():
     """Check if test data exists"""
-    print("📁 Checking test data availability...")
+    log.info("📁 Checking test data availability...")
 
-    test_files = [
-        "/Users/hp/Desktop/neurodesk/data/t1_structural/synthetic_t1.nii.gz",
-        "/Users/hp/Desktop/neurodesk/data/templates/synthetic_mni.nii.gz",
-        "/Users/hp/Desktop/neurodesk/data/diffusion/synthetic_dwi.nii.gz",
-        "/Users/hp/Desktop/neurodesk/data/diffusion/synthetic_response.txt"
-    ]
-
-    all_found = True
-    for test_file in test_files:
-        if Path(test_file).exists():
-            size = Path(test_file).stat().st_size / (1024 * 1024)  # MB
-            print(f"✅ {Path(test_file).name} ({size:.1f} MB)")
-        else:
-            print(f"❌ Missing: {test_file}")
-            all_found = False
-
-    return all_found
+    return await check_paths(report=log.info)
 
 async def main():
     """Run all tests"""
-    print("🧠 Neuroimaging MCP Tools - Functionality Test")
-    print("=" * 60)
+    log.info("🧠 Neuroimaging MCP Tools - Functionality Test")
+    log.info("=" * 60)
 
     # Preliminary checks
-    print("\n🔍 PRELIMINARY CHECKS")
-    print("-" * 30)
+    log.info("\n🔍 PRELIMINARY CHECKS")
+    log.info("-" * 30)
 
     docker_ok = await check_docker_connectivity()
     if not docker_ok:
-        print("❌ Docker is required. Please start Docker Desktop and try again.")
+        log.info("❌ Docker is required. Please start Docker Desktop and try again.")
         return
 
     niwrap_ok = await check_niwrap_configuration()
     if not niwrap_ok:
-        print("❌ NiWrap configuration failed.")
+        log.info("❌ NiWrap configuration failed.")
         return
 
     data_ok = await check_test_data()
     if not data_ok:
-        print("❌ Test data missing. Run create_test_data.py first.")
+        log.info("❌ Test data missing. Run create_test_data.py first.")
         return
 
-    print("\n✅ All preliminary checks passed!")
+    log.info("\n✅ All preliminary checks passed!")
 
     # Tool tests
-    print("\n🧪 TOOL FUNCTIONALITY TESTS")
-    print("-" * 40)
+    log.info("\n🧪 TOOL FUNCTIONALITY TESTS")
+    log.info("-" * 40)
 
     test_results = {}
 
@@ -336,36 +359,46 @@ async def main():
         ("FreeSurfer", test_freesurfer_recon_all)
     ]
 
-    for test_name, test_func in tests:
+    async def run_test(test_name, test_func):
         try:
-            result = await test_func()
-            test_results[test_name] = result
+            return await test_func()
         except Exception as e:
-            print(f"❌ {test_name} test crashed: {str(e)}")
-            test_results[test_name] = False
+            log.info(f"❌ {test_name} test crashed: {str(e)}")
+            return False
+
+    # FAST and FLIRT consume the BET output, so BET runs first; the rest are
+    # independent container runs and proceed concurrently
+    first_name, first_func = tests[0]
+    test_results[first_name] = await run_test(first_name, first_func)
+
+    results = await asyncio.gather(
+        *(run_test(test_name, test_func) for test_name, test_func in tests[1:])
+    )
+    for (test_name, _), result in zip(tests[1:], results):
+        test_results[test_name] = result
 
     # Summary
-    print("\n📊 TEST SUMMARY")
-    print("-" * 20)
+    log.info("\n📊 TEST SUMMARY")
+    log.info("-" * 20)
 
     passed = sum(test_results.values())
     total = len(test_results)
 
     for test_name, result in test_results.items():
         status = "✅ PASS" if result else "❌ FAIL"
-        print(f"{test_name:15} {status}")
+        log.info(f"{test_name:15} {status}")
 
-    print(f"\nTotal: {passed}/{total} tests passed")
+    log.info(f"\nTotal: {passed}/{total} tests passed")
 
     if passed == total:
-        print("\n🎉 All tools are working! Ready for MCP integration.")
+        log.info("\n🎉 All tools are working! Ready for MCP integration.")
     else:
-        print(f"\n⚠️  {total - passed} tools need attention before MCP testing.")
+        log.info(f"\n⚠️  {total - passed} tools need attention before MCP testing.")
 
-    print("\n💡 Next steps:")
-    print("   1. Fix any failing tools")
-    print("   2. Test MCP integration with Claude Desktop")
-    print("   3. Try real neuroimaging data")
+    log.info("\n💡 Next steps:")
+    log.info("   1. Fix any failing tools")
+    log.info("   2. Test MCP integration with Claude Desktop")
+    log.info("   3. Try real neuroimaging data")
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file